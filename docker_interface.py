@@ -1,13 +1,28 @@
+import asyncio
+import atexit
+import base64
+import io
 import os
-import shutil
-from typing import Union
+import posixpath
+import queue
+import tarfile
+import time
+from typing import Optional, Union
 import globals
 import subprocess
-import random
+import secrets
+import shlex
 import signal
+import sys
 import pexpect
 import pexpect.popen_spawn
 import pexpect.exceptions
+try:
+    import docker
+    import docker.errors
+    import requests.exceptions  # Dependency of `docker`, raised on transport failures
+except ImportError:
+    docker = None
 
 
 '''
@@ -38,16 +53,64 @@ def run_command_with_check(command: list[str]):
     return cmd
 
 
+'''
+Asynchronous version of `run_command_with_check`, so that multiple commands can run concurrently.
+
+Returns the standard output.
+'''
+async def run_command_with_check_async(command: list[str]):
+    proc = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise DockerRuntimeError('Error running docker command:\n' + stderr.decode('utf-8', 'ignore'))
+    return stdout.decode('utf-8', 'ignore')
+
+
+_docker_client = None
+_docker_client_probed = False
+
+
+'''
+Get the shared Docker Engine API client, connecting lazily on first use.
+
+All container interfaces share this client, and therefore its pool of keep-alive connections to the socket. It is closed on interpreter exit.
+
+Returns None if the `docker` package is not installed or the API socket is not reachable. Callers then fall back to the CLI.
+'''
+def get_docker_client():
+    global _docker_client, _docker_client_probed
+    if not _docker_client_probed:
+        _docker_client_probed = True
+        if docker is not None and globals.docker_api_base_url:
+            try:
+                client = docker.APIClient(base_url=globals.docker_api_base_url, max_pool_size=globals.docker_api_max_pool_size)
+                client.ping()
+                _docker_client = client
+                atexit.register(client.close)
+            except Exception:
+                _docker_client = None
+    return _docker_client
+
+
+'''
+Call a Docker Engine API method, and automatically throw error if it fails.
+
+Connection failures and malformed archive streams are reported as DockerRuntimeError as well.
+'''
+def run_api_with_check(method, *args, **kwargs):
+    try:
+        return method(*args, **kwargs)
+    except (docker.errors.DockerException, requests.exceptions.RequestException, tarfile.TarError) as e:
+        raise DockerRuntimeError('Error calling Docker API:\n' + str(e))
+
+
 '''
 Generates a random container name, prefixed by the predefined container prefix
 '''
 def random_container_name():
     # Do NOT include weird characters. This name is also used as the command prompt.
-    s = '0123456789qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM'
-    return globals.container_prefix + ''.join([
-        s[random.randrange(0, len(s))]
-        for i in range(0, 24)
-    ])
+    # 18 random bytes give exactly 24 base64 characters. Fold the two non-alphanumeric ones.
+    return globals.container_prefix + secrets.token_urlsafe(18).replace('-', 'A').replace('_', 'B')
 
 
 '''
@@ -65,6 +128,59 @@ def create_container_from_image(container_name: str, image_name: str):
     return ContainerInterface(container_name)
 
 
+'''
+Write a tar stream containing a single regular file to a file object
+'''
+def _write_single_file_tar(fileobj, name: str, data: bytes):
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+
+
+'''
+A readable file object over an iterable of byte chunks, such as the archive stream from the Docker Engine API
+
+This lets the archive be read as it arrives, without joining all chunks into one buffer first.
+'''
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b'')
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+'''
+Read the first member of a tar stream
+
+Returns whether it is a regular file, and its content if so.
+'''
+def _read_single_file_tar(fileobj):
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        member = tar.next()
+        if member is None:
+            return True, None
+        if not member.isfile():
+            return False, None
+        file = tar.extractfile(member)
+        assert file is not None
+        return True, file.read()
+
+
 '''
 The interface to a container name, which could be running or not.
 
@@ -81,6 +197,10 @@ class ContainerInterface:
     Start the container. Do this before interacting with the container.
     '''
     def start(self):
+        client = get_docker_client()
+        if client is not None:
+            run_api_with_check(client.start, self.name)
+            return
         run_command_with_check([
             globals.docker_executable, 'start', self.name
         ])
@@ -90,6 +210,10 @@ class ContainerInterface:
     Stop the container.
     '''
     def stop(self):
+        client = get_docker_client()
+        if client is not None:
+            run_api_with_check(client.stop, self.name)
+            return
         run_command_with_check([
             globals.docker_executable, 'stop', self.name
         ])
@@ -101,10 +225,27 @@ class ContainerInterface:
     It is recommended to kill before deleting if the container is no longer needed. This prevents wasting time on trying to shut down the container gracefully.
     '''
     def kill(self):
+        client = get_docker_client()
+        if client is not None:
+            run_api_with_check(client.kill, self.name)
+            return
         run_command_with_check([
             globals.docker_executable, 'kill', self.name
         ])
     
+    
+    '''
+    Asynchronous version of `kill`
+    '''
+    async def kill_async(self):
+        client = get_docker_client()
+        if client is not None:
+            await asyncio.to_thread(run_api_with_check, client.kill, self.name)
+            return
+        await run_command_with_check_async([
+            globals.docker_executable, 'kill', self.name
+        ])
+    
         
     '''
     Delete the container forcefully
@@ -112,9 +253,26 @@ class ContainerInterface:
     Note that this will not be called when the container interface is destroyed. You must do it manually.
     '''
     def rm(self):
+        client = get_docker_client()
+        if client is not None:
+            run_api_with_check(client.remove_container, self.name, force=True)
+            return
         run_command_with_check([
             globals.docker_executable, 'rm', '-f', self.name
         ])
+    
+    
+    '''
+    Asynchronous version of `rm`
+    '''
+    async def rm_async(self):
+        client = get_docker_client()
+        if client is not None:
+            await asyncio.to_thread(run_api_with_check, client.remove_container, self.name, force=True)
+            return
+        await run_command_with_check_async([
+            globals.docker_executable, 'rm', '-f', self.name
+        ])
         
 
     '''    
@@ -155,53 +313,89 @@ class ContainerInterface:
        
  
     '''
-    Generate filename for temporary exchange file
+    Stream a single file into the container as a tar archive
+    
+    Uses the Docker Engine API if available, otherwise pipes the archive into `docker cp -`.
+    '''
+    def _cp_stream_in(self, container_path: str, data: bytes):
+        dirname, basename = posixpath.split(container_path)
+        dirname = dirname or '.'
+        
+        client = get_docker_client()
+        if client is not None:
+            archive = io.BytesIO()
+            _write_single_file_tar(archive, basename, data)
+            run_api_with_check(client.put_archive, self.name, dirname, archive.getvalue())
+            return
+        
+        proc = subprocess.Popen([
+            globals.docker_executable, 'cp',
+            '-',
+            self.name + ':' + dirname
+        ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            _write_single_file_tar(proc.stdin, basename, data)
+        except BrokenPipeError:
+            pass  # The process exited early. Its error message is collected below.
+        _, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise DockerRuntimeError('Error copying file into container:\n' + stderr.decode('utf-8', 'ignore'))
+
+
     '''
-    def __tmp_filename(self, temp_dir):
-        s = '0123456789qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM'
-        return os.path.join(temp_dir, self.name + '__tmp-' + ''.join([
-            s[random.randrange(0, len(s))]
-            for i in range(0, 16)
-        ]))
+    Stream a single file out of the container as a tar archive
+    
+    Uses the Docker Engine API if available, otherwise reads the archive from `docker cp ... -`.
+    '''
+    def _cp_stream_out(self, container_path: str) -> bytes:
+        client = get_docker_client()
+        if client is not None:
+            def read_archive():
+                stream, _ = client.get_archive(self.name, container_path)
+                return _read_single_file_tar(_ChunkReader(stream))
+            is_file, result = run_api_with_check(read_archive)
+        else:
+            proc = subprocess.Popen([
+                globals.docker_executable, 'cp',
+                self.name + ':' + container_path,
+                '-'
+            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            is_file, result = True, None
+            try:
+                is_file, result = _read_single_file_tar(proc.stdout)
+            except tarfile.TarError:
+                pass  # Usually an empty stream because the process failed. Its error message is collected below.
+            _, stderr = proc.communicate()
+            if proc.returncode != 0:
+                raise DockerRuntimeError('Error copying file from container:\n' + stderr.decode('utf-8', 'ignore'))
+        
+        if not is_file:
+            raise DockerRuntimeError('The requested file `' + container_path + '` is not a regular file')
+        if result is None:
+            raise DockerRuntimeError('Failed to read `' + container_path + '` from the archive stream')
+        return result
 
  
     '''
-    Read binary file from the container by using a temporary file
+    Read binary file from the container
     
-    This method may throw IO errors on top of Docker errors.
+    The file is streamed through `docker cp` as a tar archive, so no temporary file is created on the host. `temp_dir` is unused, and only accepted for compatibility.
     
     Do not use unless necessary. If transferring a text file is needed, please prefer the shell interface.
     '''
-    def read_binary_file_with_temp(self, container_path: str, temp_dir='/tmp/'):
-        tmp_filename = self.__tmp_filename(temp_dir)
-        try:
-            self.pull_file(container_path, tmp_filename)
-            if os.path.isdir(tmp_filename):
-                shutil.rmtree(tmp_filename)
-                raise DockerRuntimeError('The requested file `' + container_path + '` is a directory')
-            result = open(tmp_filename, 'rb').read()
-        finally:
-            if os.path.exists(tmp_filename): os.remove(tmp_filename)
-        return result
+    def read_binary_file_with_temp(self, container_path: str, temp_dir=None):
+        return self._cp_stream_out(container_path)
     
     
     '''
-    Write binary data to some file in the container by using a temporary file
+    Write binary data to some file in the container
     
-    This method may throw IO errors on top of Docker errors.
+    The data is streamed through `docker cp` as a tar archive, so no temporary file is created on the host. `temp_dir` is unused, and only accepted for compatibility.
     
     Do not use unless necessary. If transferring a text file is needed, please prefer the shell interface.
     '''
-    def write_binary_file_with_temp(self, container_path: str, data: bytes, temp_dir='/tmp/'):
-        tmp_filename = self.__tmp_filename(temp_dir)
-        try:
-            open(tmp_filename, 'wb').write(data)
-            self.push_file(tmp_filename, container_path)
-        finally:
-            if os.path.exists(tmp_filename): os.remove(tmp_filename)
-
-
-    # TODO: Stream binary files directly using `docker cp` with host filename `-`?
+    def write_binary_file_with_temp(self, container_path: str, data: bytes, temp_dir=None):
+        self._cp_stream_in(container_path, data)
     
     
     '''
@@ -210,25 +404,36 @@ class ContainerInterface:
     You may have multiple open shells at the same time.
     '''
     def open_shell(self):
-        pipe = pexpect.popen_spawn.PopenSpawn([
+        command = [
             globals.docker_executable, 'exec',
             '-it', '--env', 'TERM=vanilla',
             self.name, '/bin/bash'
-        ], timeout=30, maxread=1024*1024*30, encoding='utf-8', codec_errors='ignore')
+        ]
+        if sys.platform != 'win32':
+            # A real pty is read directly, without the reader thread and queue of `PopenSpawn`.
+            # Host-side echo is disabled here. The echo of the pty inside the container is still disabled with `stty` below.
+            # `maxread` is the size passed to each `os.read` on the pty. A pty returns at most a few KiB at a time, so a large value only costs allocation.
+            pipe = pexpect.spawn(command[0], command[1:], timeout=30, maxread=65536, encoding='utf-8', codec_errors='ignore', echo=False)
+            # The 50ms delay before each send guards against typing ahead of a password prompt. We always synchronize on the prompt instead.
+            pipe.delaybeforesend = None
+        else:
+            pipe = pexpect.popen_spawn.PopenSpawn(command, timeout=30, maxread=1024*1024*30, encoding='utf-8', codec_errors='ignore')
         try:
-            pipe.expect(r'[\#\$] ')
+            # Wait until the shell is actually reading input.
+            # The sentinel is split by quotes in the command, so its echo cannot be mistaken for the output.
+            pipe.sendline('printf "__READY""_%s__\\n" "$$"')
+            pipe.expect_exact('__READY_')
+            pipe.expect_exact('__')  # Skip over the PID token
             
             # ==== Command prompt setup ====
             top_level_ps1 = 'ShellInterface@' + self.name + '$ '
-            # Disable echo
-            pipe.sendline('stty -echo')
-            pipe.expect(r'[\#\$] ')
-            # Clear the prompt first
-            pipe.sendline('PS1=""')
-            # Prevent conda from changing the command prompt
-            pipe.sendline('conda config --set changeps1 False')
-            # Set our unique command prompt
-            pipe.sendline(f'PS1="{top_level_ps1}"')
+            # Disable echo and LF-to-CRLF translation, prevent conda from changing the command prompt, and set our unique command prompt, all in one line.
+            # The prompt is split by quotes, so that it can only be matched once it is actually printed.
+            pipe.sendline(
+                'stty -echo -onlcr; '
+                'conda config --set changeps1 False 2>/dev/null; '
+                "PS1='ShellInterface@''" + self.name + "$ '"
+            )
             
             # ==== Back to track ====
             # Expect the command prompt we have just set
@@ -241,9 +446,22 @@ class ContainerInterface:
             assert isinstance(pipe.before, str)
             raise ShellFailure('Failed to open shell:\n' + pipe.before)
         
-        return ShellInterface(pipe, top_level_ps1)
+        return ShellInterface(pipe, top_level_ps1, self)
             
 
+# Translation table for `ShellInterface.quote_string`, escaping the quote and control characters in one pass
+_QUOTE_TABLE = str.maketrans({
+    chr(i): f"'$'\\{oct(i)[2:].zfill(3)}''"
+    for i in range(32)
+} | {
+    "'": "'\"'\"'"
+})
+
+
+# Text files of at least this many characters (or bytes, when reading) are transferred with `docker cp` rather than through the shell
+_CP_THRESHOLD = 65536
+
+
 '''
 The interface to the shell inside Docker.
 
@@ -252,9 +470,10 @@ For stability, the shell must have a unique and constant command prompt. This is
 The shell will NOT be automatically closed on error, but if any error occurs, you should kill it and reopen a new shell.
 '''
 class ShellInterface:
-    def __init__(self, pipe: pexpect.popen_spawn.PopenSpawn, prompt: str):
+    def __init__(self, pipe: Union['pexpect.spawn', pexpect.popen_spawn.PopenSpawn], prompt: str, container: ContainerInterface):
         self.pipe = pipe
         self.prompt = prompt
+        self.container = container
     
     
     '''
@@ -262,46 +481,39 @@ class ShellInterface:
     '''
     @staticmethod
     def quote_string(s: str):
-        s = s.replace("'", "'\"'\"'")
-        for i in range(32):
-            s = s.replace(chr(i), f"'$'\\{oct(i)[2:].zfill(3)}''")
-        return "'" + s + "'"
+        if s.isascii() and s.isalnum():
+            return "'" + s + "'"
+        return "'" + s.translate(_QUOTE_TABLE) + "'"
     
     
     '''
     Convert command to string, if it is given in form of an array.
+    
+    The command word is always quoted with `quote_string`, so that it is never expanded as an alias or parsed as a keyword.
+    `shlex.join` is used for the arguments in the common case. It leaves control characters as is, which the tty would mangle (e.g. CR becomes LF), so `quote_string` is used if there are any.
     '''
     @staticmethod
     def command_to_string(command: Union[str, list[str]]):
         if isinstance(command, list):
-            return ' '.join(map(lambda s: ShellInterface.quote_string(s), command))
+            if len(command) <= 1:
+                return ' '.join(map(ShellInterface.quote_string, command))
+            joined = ShellInterface.quote_string(command[0]) + ' ' + shlex.join(command[1:])
+            if joined.isprintable():
+                return joined
+            return ' '.join(map(ShellInterface.quote_string, command))
         return command
     
     
     '''
-    Get to the last command prompt
-    '''
-    def __get_command_prompt(self):
-        while True:
-            after_text = self.pipe.after
-            if not isinstance(after_text, str): break
-            if after_text.find(self.prompt, len(self.prompt)) != -1: # if we may find a second prompt string
-                self.pipe.expect_exact(self.prompt)
-            else:
-                break
-    
-    
+    Send a command string to the active shell prompt
     '''
-    Send a command to the active shell prompt
-    '''
-    def __send_command(self, command: Union[str, list[str]]):
-        command = self.command_to_string(command)
+    def __send_command(self, command: str, timeout: Optional[float]):
         self.pipe.sendline(command)
-        n_newlines = len([c for c in command if c in '\r\n'])
+        n_newlines = command.count('\n') + command.count('\r')
         try:
             try:
                 for i in range(n_newlines):
-                    self.pipe.expect_exact('> ')
+                    self.pipe.expect_exact('> ', timeout=timeout)
             except pexpect.exceptions.TIMEOUT:
                 raise ShellTimeout('Timeout waiting for multiline prompt when sending command:\n' + command)
         except pexpect.exceptions.EOF:
@@ -309,61 +521,226 @@ class ShellInterface:
     
     
     '''
-    Wait for next shell prompt
+    Wait for next shell prompt. The command string is only used for error messages.
     '''
-    def __wait_next_prompt(self, command: Union[str, list[str]]):
-        command = self.command_to_string(command)
+    def __wait_next_prompt(self, command: str, timeout: Optional[float]):
         try:
-            try:
-                self.pipe.expect_exact(self.prompt)  # Expect the next command prompt
-            except pexpect.exceptions.TIMEOUT:
-                raise ShellTimeout('Timeout waiting for next shell prompt when executing command:\n' + command)
-            
-        except pexpect.exceptions.EOF:
+            # EOF is matched along with the prompt, so that a dead shell is reported as soon as its output ends
+            index = self.pipe.expect_exact([self.prompt, pexpect.EOF], timeout=timeout)
+        except pexpect.exceptions.TIMEOUT:
+            raise ShellTimeout('Timeout waiting for next shell prompt when executing command:\n' + command)
+        if index == 1:
             raise ShellFailure('Shell closed while executing command:\n' + command)
     
     
     '''
     Run a command and wait for output text. Does not strip the text.
+    
+    `timeout` is in seconds. -1 uses the default timeout of the shell, and None waits forever.
     '''
-    def run_command_blocking(self, command: Union[str, list[str]], extra_inputs: list[str] = [], strip_final_newline: bool = True) -> str:
-        self.__get_command_prompt()
-        self.__send_command(command)
+    def run_command_blocking(self, command: Union[str, list[str]], extra_inputs: list[str] = [], strip_final_newline: bool = True, timeout: Optional[float] = -1) -> str:
+        command_str = self.command_to_string(command)
+        self.__send_command(command_str, timeout)
         for inp in extra_inputs:
             self.pipe.send(inp)
-        self.__wait_next_prompt(command)
+        self.__wait_next_prompt(command_str, timeout)
         
         before_text = self.pipe.before
         if not isinstance(before_text, str):
             raise ShellFailure('Failed to run shell command, the returned result is not a string.')
         
-        before_text = before_text.replace('\r\n', '\n')  # The tty seems to transform LF into CRLF. I don't know why.
-       
-        if strip_final_newline and before_text[-1:] == '\n':
+        # The tty no longer transforms LF into CRLF, since `onlcr` is disabled when opening the shell.
+        
+        if strip_final_newline and before_text.endswith('\n'):
+            # Python strings are immutable, so this one copy cannot be avoided. Pass `strip_final_newline=False` to skip it.
             return before_text[:-1]
         return before_text
     
     
+    '''
+    Resolve the file to read with `docker cp`, following symlinks from the working directory of this shell
+    
+    Returns None if the file should be read with `cat` in the shell instead. This is the case for small files, and for anything `docker cp` cannot read faithfully: non-regular files, files on other mounts (e.g. /proc, tmpfs, volumes), and files the shell user cannot read.
+    '''
+    def __resolve_cp_read_path(self, filename: str) -> Optional[str]:
+        path = self.run_command_blocking(
+            'p=$(readlink -f -- ' + self.quote_string(filename) + ') && '
+            '[ -f "$p" ] && [ -r "$p" ] && '
+            '[ "$(stat -c %s -- "$p")" -ge ' + str(_CP_THRESHOLD) + ' ] && '
+            '[ "$(stat -c %m -- "$p")" = / ] && '
+            'printf %s "$p"'
+        )
+        return path or None
+    
+    
+    '''
+    Resolve the file to write with `docker cp`, following symlinks from the working directory of this shell
+    
+    Returns None if the file should be written through the shell instead. `docker cp` recreates the file from a tar header, so it is only used for new files in a writable directory on the root mount. Existing files keep their mode this way.
+    '''
+    def __resolve_cp_write_path(self, filename: str) -> Optional[str]:
+        path = self.run_command_blocking(
+            'p=$(readlink -f -- ' + self.quote_string(filename) + ') && '
+            '[ ! -e "$p" ] && d=$(dirname -- "$p") && [ -w "$d" ] && '
+            '[ "$(stat -c %m -- "$d")" = / ] && '
+            'printf %s "$p"'
+        )
+        return path or None
+    
+    
     '''
     Echo text file into the container.
     
-    This is NOT meant for transferring binary files or very large files.
+    Small files are echoed through the shell. Larger new files are streamed with `docker cp`, which is not limited by the maximum command length.
+    
+    This is NOT meant for transferring binary files.
     '''
     def echo_file_to_container(self, filename: str, content: str):
-        # Cannot directly echo.
-        # Hint: Nothing is printed with echo -n '-n', but ` -n` can be printed with echo -n "" '-n'.
-        return self.run_command_blocking('echo -n "" ' + self.quote_string(content) + ' | tail -c +2 > ' + self.quote_string(filename))
+        if len(content) >= _CP_THRESHOLD:
+            path = self.__resolve_cp_write_path(filename)
+            if path is not None:
+                self.container.write_binary_file_with_temp(path, content.encode('utf-8'))
+                return ''
+        return self._echo_file_to_container_via_shell(filename, content)
+    
+    
+    '''
+    Echo text file into the container through the shell.
+    '''
+    def _echo_file_to_container_via_shell(self, filename: str, content: str):
+        # Base64 text is shell-safe, so it needs no quoting, and `printf %s` prints it as is.
+        encoded = base64.b64encode(content.encode('utf-8')).decode('ascii')
+        return self.run_command_blocking('printf %s ' + encoded + ' | base64 -d > ' + self.quote_string(filename))
     
     
     '''
     Cat text file from the container.
     
-    This is NOT meant for transferring binary files or very large files.
+    Large regular files are streamed with `docker cp`. Everything else is printed with `cat` through the shell.
+    
+    This is NOT meant for transferring binary files.
     '''
     def cat_file_from_container(self, filename: str):
-        return self.run_command_blocking('cat ' + self.quote_string(filename), strip_final_newline=False)
+        path = self.__resolve_cp_read_path(filename)
+        if path is None:
+            return self.run_command_blocking('cat ' + self.quote_string(filename), strip_final_newline=False)
+        return self.container.read_binary_file_with_temp(path).decode('utf-8', 'ignore')
     
     
     # Close the shell
+    # The process is killed with a plain signal and reaped right away, instead of being left for pexpect to clean up on garbage collection.
+    # It is safe to call this more than once. A process that has already been reaped is never signalled, as its PID may have been reused.
     def kill(self):
-        self.pipe.kill(signal.SIGKILL)
+        if isinstance(self.pipe, pexpect.popen_spawn.PopenSpawn):
+            if self.pipe.proc.poll() is None:
+                os.kill(self.pipe.pid, signal.SIGKILL)
+                self.pipe.wait()
+            return
+        if self.pipe.isalive():
+            os.kill(self.pipe.pid, signal.SIGKILL)
+            self.pipe.wait()
+        if not self.pipe.closed:
+            # The child is already reaped, so there is no need to wait for the kernel when closing the pty.
+            self.pipe.ptyproc.delayafterclose = 0
+            self.pipe.close()
+
+
+'''
+A pool of pre-warmed containers, each with an open shell.
+
+Creating, starting and setting up a shell for a container is slow. The pool does it ahead of time, and reuses containers that are released back to it.
+
+The pool owns all containers it creates. Call `close` to kill and delete them.
+
+**Always remember to handle potential DockerRuntimeError!**
+'''
+class ContainerPool:
+    def __init__(self, image_name: str, size: int):
+        self.image_name = image_name
+        self.size = size
+        self._idle = queue.Queue(maxsize=size)
+        # Every container owned by the pool, mapped to its shell, or None if the shell is not open yet
+        self._all = {}
+        try:
+            for i in range(size):
+                self._idle.put_nowait(self.__open_container())
+        except BaseException:
+            # The caller never gets the pool, so it cannot close it
+            self.close()
+            raise
+    
+    
+    '''
+    Create and start a new container, and open a shell in it
+    '''
+    def __open_container(self):
+        container = create_container_from_image(random_container_name(), self.image_name)
+        self._all[container] = None  # Registered before starting, so that `close` can clean it up if anything fails
+        container.start()
+        shell = container.open_shell()
+        self._all[container] = shell
+        return container, shell
+    
+    
+    '''
+    Kill and delete a container owned by the pool
+    '''
+    def __discard(self, container: ContainerInterface, shell: ShellInterface):
+        shell.kill()
+        container.rm()
+        del self._all[container]  # Only after `rm` succeeds, so that `close` can retry otherwise
+    
+    
+    '''
+    Take a container and its shell from the pool. A new one is created if the pool is empty.
+    '''
+    def acquire(self) -> tuple[ContainerInterface, ShellInterface]:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.__open_container()
+    
+    
+    '''
+    Return a container and its shell to the pool.
+    
+    The working directory is reset, and `/tmp/work` is emptied. If this fails, or the pool is already full, the container is discarded.
+    '''
+    def release(self, container: ContainerInterface, shell: ShellInterface):
+        try:
+            # The exit status is not reported by the shell interface, so success is printed explicitly
+            result = shell.run_command_blocking('cd / && rm -rf /tmp/work && mkdir /tmp/work && echo __OK__')
+        except (ShellFailure, ShellTimeout):
+            result = None
+        if result != '__OK__':
+            self.__discard(container, shell)
+            return
+        try:
+            self._idle.put_nowait((container, shell))
+        except queue.Full:
+            self.__discard(container, shell)
+    
+    
+    '''
+    Kill and delete all containers created by the pool, including the ones not yet released. Their shells are killed as well.
+    
+    The containers are deleted concurrently. This cannot be called from a running event loop; use `close_async` there.
+    '''
+    def close(self):
+        asyncio.run(self.close_async())
+    
+    
+    '''
+    Asynchronous version of `close`
+    '''
+    async def close_async(self):
+        entries, self._all = self._all, {}
+        self._idle = queue.Queue(maxsize=self.size)
+        for shell in entries.values():
+            if shell is not None:
+                shell.kill()
+        # `rm -f` also kills the container, so there is no need to kill them separately.
+        results = await asyncio.gather(*(container.rm_async() for container in entries), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
@@ -1,3 +1,8 @@
 # TODO: Put these into the actual globals.py
 docker_executable = 'podman'
 container_prefix = 'swe-workspace-'
+# Docker Engine API socket, e.g. 'unix:///var/run/docker.sock'. It must belong to the same engine as `docker_executable`.
+# Used if the `docker` package is installed and the socket is reachable. Otherwise, or if set to None, the CLI is used.
+docker_api_base_url = None
+# Maximum number of kept-alive connections to the Docker Engine API socket, shared by all containers.
+docker_api_max_pool_size = 16
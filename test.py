@@ -1,12 +1,11 @@
 from docker_interface import *
 
 if __name__ == '__main__':
-    container = create_container_from_image(random_container_name(), 'continuumio/miniconda3')
-    container.start()
+    pool = ContainerPool('continuumio/miniconda3', 1)
     
     try:
         # container = ContainerInterface('swe-workspace-to09CC8cd8apDSmoOn2EFduu')
-        shell = container.open_shell()
+        container, shell = pool.acquire()
         
         container.push_file(__file__, '/root/test.py')
         
@@ -16,6 +15,9 @@ if __name__ == '__main__':
         print(shell.run_command_blocking('ls'))
         print(shell.run_command_blocking('cat /root/test.py'))
         print(shell.run_command_blocking('cat /root/test.py > /root/test-copy.py'))
+        assert shell.run_command_blocking('cat /root/test.py', strip_final_newline=False) == open(__file__).read(), 'Output of cat through the shell differs from the original file'
+        assert shell.cat_file_from_container('/root/test.py') == open(__file__).read(), 'File read with cat_file_from_container differs from the original file'
+        assert container.read_binary_file_with_temp('/root/test.py') == open(__file__, 'rb').read(), 'File read with docker cp differs from the original file'
         
         open('retrieved_file_cat.txt', 'w').write(
             shell.run_command_blocking('cat /root/test.py')
@@ -26,6 +28,12 @@ if __name__ == '__main__':
         
         print(shell.run_command_blocking(['echo', '14@3214###\'$$$\n2r31eqwr99*@#$*@$*$\r\nAAAAAA\rBBB']))
         print(shell.run_command_blocking('echo $?'))
+        
+        # List commands must not be subject to aliases or keywords
+        shell.run_command_blocking("alias echo='echo aliased'")
+        assert shell.run_command_blocking(['echo', 'plain']) == 'plain', 'List command was expanded as an alias'
+        shell.run_command_blocking('unalias echo')
+        print(shell.run_command_blocking(['if', 'x'], timeout=5))
         print(shell.run_command_blocking('non-existent-1145141919810'))
         
         # File transfer
@@ -39,6 +47,10 @@ if __name__ == '__main__':
             container.read_binary_file_with_temp('/etc')
         except Exception as e:
             print(repr(e))
+        
+        # Reuse the container
+        pool.release(container, shell)
+        container, shell = pool.acquire()
+        print(shell.run_command_blocking('pwd && ls /tmp/work'))
     finally:
-        container.kill()
-        container.rm()
+        pool.close()